@@ -1,10 +1,14 @@
-const fs = require("fs");
-const TelegramBot = require("node-telegram-bot-api");
+import fs from "fs";
+import https from "https";
+import TelegramBot from "node-telegram-bot-api";
 
 const TOKEN = process.env.TELEGRAM_TOKEN;
 const CHAT_ID = process.env.CHAT_ID;
 
-const bot = new TelegramBot(TOKEN, { polling: false });
+const bot = new TelegramBot(TOKEN, {
+  polling: false,
+  request: { agent: new https.Agent({ keepAlive: true }) }
+});
 const OFFERS_FILE = "new_offers.json";
 
 if (!fs.existsSync(OFFERS_FILE)) {
@@ -16,7 +20,9 @@ const offers = JSON.parse(fs.readFileSync(OFFERS_FILE));
 
 const MAX_OFFERS = 10;
 
-offers.slice(0, MAX_OFFERS).forEach(async (offer) => {
+// envios em paralelo (no maximo MAX_OFFERS, bem abaixo do limite do Telegram)
+// com conexoes keep-alive; o script espera todos antes de sair
+const results = await Promise.allSettled(offers.slice(0, MAX_OFFERS).map((offer) => {
   const message = `
 🛍️ *Oferta do dia!*
 
@@ -27,7 +33,13 @@ offers.slice(0, MAX_OFFERS).forEach(async (offer) => {
 👉 ${offer.link}
 `;
 
-  await bot.sendMessage(CHAT_ID, message, {
+  return bot.sendMessage(CHAT_ID, message, {
     parse_mode: "Markdown"
   });
-});
+}));
+
+const failed = results.filter((r) => r.status === "rejected");
+
+if (failed.length) {
+  console.log(`${failed.length} oferta(s) nao enviada(s):`, failed[0].reason.message);
+}
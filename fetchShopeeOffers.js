@@ -3,6 +3,8 @@
 import express from "express";
 import axios from "axios";
 import crypto from "crypto";
+import http from "http";
+import https from "https";
 import fs from "fs/promises";
 import path from "path";
 import TelegramBot from "node-telegram-bot-api";
@@ -13,10 +15,64 @@ TELEGRAM_CHAT_ID,
 SHOPEE_APP_ID,
 SHOPEE_APP_SECRET,
 ML_ACCESS_TOKEN,
+LOG_LEVEL="info",
+SEARCH_KEYWORDS,
+RUN_ONCE,
 PORT=3000
 }=process.env;
 
-const bot = TELEGRAM_BOT_TOKEN ? new TelegramBot(TELEGRAM_BOT_TOKEN) : null;
+// LOG (LOG_LEVEL=debug|info|warn|error, sem diferenciar maiusculas; abaixo do
+// nivel nada e formatado nem escrito)
+const LOG_LEVELS={debug:10,info:20,warn:30,error:40};
+const LOG_LEVEL_NAME=String(LOG_LEVEL).toLowerCase();
+const LOG_LEVEL_KNOWN=Object.hasOwn(LOG_LEVELS,LOG_LEVEL_NAME);
+const LOG_THRESHOLD=LOG_LEVEL_KNOWN ? LOG_LEVELS[LOG_LEVEL_NAME] : LOG_LEVELS.info;
+const DEBUG=LOG_THRESHOLD<=LOG_LEVELS.debug;
+
+const log={
+ debug:(...args)=>{ if(DEBUG) console.log(...args); },
+ info:(...args)=>{ if(LOG_THRESHOLD<=LOG_LEVELS.info) console.log(...args); },
+ warn:(...args)=>{ if(LOG_THRESHOLD<=LOG_LEVELS.warn) console.warn(...args); },
+ error:(...args)=>{ if(LOG_THRESHOLD<=LOG_LEVELS.error) console.error(...args); }
+};
+
+if(!LOG_LEVEL_KNOWN) log.warn("LOG_LEVEL desconhecido, usando info:",LOG_LEVEL);
+
+const RESPONSE_PREVIEW_CHARS=500;
+
+// HTTP (conexoes keep-alive reaproveitadas entre chamadas)
+const httpAgent=new http.Agent({keepAlive:true,maxSockets:16});
+const httpsAgent=new https.Agent({keepAlive:true,maxSockets:16});
+
+const HTTP_TIMEOUT_MS=20000;
+
+const api=axios.create({
+ httpAgent,
+ httpsAgent,
+ timeout:HTTP_TIMEOUT_MS,
+ headers:{"User-Agent":"Mozilla/5.0"}
+});
+
+// repete falhas transitorias (rede, 429, 5xx) com espera exponencial: 0,5s, 1s, 2s
+const RETRY_STATUS=new Set([429,500,502,503,504]);
+const MAX_RETRIES=3;
+
+api.interceptors.response.use(null,async err=>{
+
+ const config=err.config;
+ const status=err.response?.status;
+
+ if(!config || (status && !RETRY_STATUS.has(status))) throw err;
+
+ config.retryCount=(config.retryCount||0)+1;
+ if(config.retryCount>MAX_RETRIES) throw err;
+
+ await delay(500*2**(config.retryCount-1));
+
+ return api(config);
+});
+
+const bot = TELEGRAM_BOT_TOKEN ? new TelegramBot(TELEGRAM_BOT_TOKEN,{request:{agent:httpsAgent,gzip:true,timeout:HTTP_TIMEOUT_MS}}) : null;
 
 const app = express();
 app.use(express.json());
@@ -24,24 +80,88 @@ app.use(express.json());
 // CONFIG
 const PUSH_INTERVAL_MINUTES=30;
 const OFFERS_PER_PUSH=10;
-const DELAY_BETWEEN_OFFERS_MS=2500;
+const MEDIA_GROUP_SIZE=10;
 const MIN_DISCOUNT=20;
 
 // STORAGE
-const SENT_FILE=path.resolve("./sent_links.json");
-let sentDB={};
+// log so de acrescimo: uma linha "<hash> <timestamp>" por link enviado.
+// cada ciclo so acrescenta as linhas novas; o arquivo inteiro so e
+// reescrito (compactado) quando passa de 2x o historico vivo
+const SENT_FILE=path.resolve("./sent_links.log");
+const LEGACY_SENT_FILE=path.resolve("./sent_links.json");
+let sentDB=new Map();
+
+// linhas no arquivo, incluindo as ja expiradas que so sairam do Map
+const SENT_COMPACT_RATIO=2;
+let sentLines=0;
+
+// 16 hex = 64 bits do SHA-256 do link: colisao desprezivel para o historico
+// de 3 dias e 1/4 da memoria/disco do hash inteiro
+const SENT_KEY_CHARS=16;
+
+function offerKey(link){
+ return sha256Hex(link).slice(0,SENT_KEY_CHARS);
+}
 
 async function loadSent(){
+
+ sentDB=new Map();
+ sentLines=0;
+ let migrated=false;
+
+ try{
+  const legacy=JSON.parse(await fs.readFile(LEGACY_SENT_FILE,"utf8"));
+  for(const [k,t] of Object.entries(legacy)) sentDB.set(k.slice(0,SENT_KEY_CHARS),t);
+  migrated=true;
+ }catch{}
+
  try{
   const raw=await fs.readFile(SENT_FILE,"utf8");
-  sentDB=JSON.parse(raw);
- }catch{
-  sentDB={};
+  for(const line of raw.split("\n")){
+   const [k,t]=line.split(" ");
+   if(!k || !t) continue;
+   sentLines++;
+   if(k.length>SENT_KEY_CHARS) migrated=true;
+   // link reenviado aparece de novo no log: remove antes de inserir para a
+   // chave ir para o fim e o Map seguir em ordem de envio (cleanupDB depende)
+   const key=k.slice(0,SENT_KEY_CHARS);
+   sentDB.delete(key);
+   sentDB.set(key,Number(t));
+  }
+ }catch{}
+
+ cleanupDB();
+
+ if(migrated || sentLines>SENT_COMPACT_RATIO*sentDB.size){
+  await compactSent();
+  if(migrated) await fs.rm(LEGACY_SENT_FILE,{force:true});
  }
+
 }
 
-async function saveSent(){
- await fs.writeFile(SENT_FILE,JSON.stringify(sentDB,null,2));
+// grava num .tmp e renomeia: um crash no meio nunca deixa o arquivo truncado
+async function writeFileAtomic(file,data){
+ const tmp=`${file}.tmp`;
+ await fs.writeFile(tmp,data);
+ await fs.rename(tmp,file);
+}
+
+function sentLine(k,t){
+ return `${k} ${t}\n`;
+}
+
+async function compactSent(){
+ let data="";
+ for(const [k,t] of sentDB) data+=sentLine(k,t);
+ await writeFileAtomic(SENT_FILE,data);
+ sentLines=sentDB.size;
+}
+
+// processo de longa duracao tambem compacta, sem esperar o proximo restart
+async function appendSent(keys,t){
+ await fs.appendFile(SENT_FILE,keys.map(k=>sentLine(k,t)).join(""));
+ sentLines+=keys.length;
+ if(sentLines>SENT_COMPACT_RATIO*sentDB.size) await compactSent();
 }
 
 function sha256Hex(s){
@@ -52,18 +172,70 @@ function delay(ms){
  return new Promise(r=>setTimeout(r,ms));
 }
 
+// LIMITE DE ENVIO (janela deslizante: no maximo `burst` mensagens por `windowMs`)
+class DelayQueue{
+
+ constructor(burst,windowMs){
+  this.burst=burst;
+  this.windowMs=windowMs;
+  this.stamps=[];
+ }
+
+ async acquire(count=1){
+  // lote maior que o burst nunca caberia na janela: ocupa a janela inteira
+  count=Math.min(count,this.burst);
+  for(;;){
+   const now=Date.now();
+   while(this.stamps.length && now-this.stamps[0]>=this.windowMs) this.stamps.shift();
+   if(this.stamps.length+count<=this.burst) break;
+   await delay(this.stamps[0]+this.windowMs-now);
+  }
+  const now=Date.now();
+  for(let i=0;i<count;i++) this.stamps.push(now);
+ }
+
+}
+
+// limites do Telegram: 30 msg/s no total e 20 msg/min por grupo
+const globalQ=new DelayQueue(30,1000);
+const groupQ=new DelayQueue(20,60*1000);
+
+async function throttle(count=1){
+ await globalQ.acquire(count);
+ await groupQ.acquire(count);
+}
+
+const MAX_FLOOD_RETRIES=2;
+
+// em 429 o Telegram informa quantos segundos esperar (parameters.retry_after)
+async function withRetryAfter(send){
+ for(let attempt=0;;attempt++){
+  try{
+   return await send();
+  }catch(e){
+   const retryAfter=e.response?.body?.parameters?.retry_after;
+   if(!retryAfter || attempt>=MAX_FLOOD_RETRIES) throw e;
+   log.debug("429 do Telegram, aguardando",retryAfter,"s");
+   await delay(retryAfter*1000+100);
+  }
+ }
+}
+
 // LIMPA LINKS ANTIGOS (3 dias)
+const SENT_TTL_MS=3*24*60*60*1000;
+
+// o Map fica em ordem de envio, entao os expirados estao sempre no inicio:
+// para no primeiro link ainda valido em vez de varrer o historico todo
 function cleanupDB(){
  const now=Date.now();
- for(const k in sentDB){
-  if(now-sentDB[k] > 3*24*60*60*1000){
-   delete sentDB[k];
-  }
+ for(const [k,t] of sentDB){
+  if(now-t <= SENT_TTL_MS) break;
+  sentDB.delete(k);
  }
 }
 
-// KEYWORDS
-const KEYWORDS=[
+// KEYWORDS (SEARCH_KEYWORDS="a;b;c" substitui a lista padrao)
+const DEFAULT_KEYWORDS=[
 "smart tv",
 "notebook",
 "geladeira",
@@ -76,51 +248,192 @@ const KEYWORDS=[
 "ferramenta"
 ];
 
+// normalizada uma vez no load: sem vazias nem repetidas, que sorteariam
+// a mesma busca (mesma ida e volta, mesmas ofertas ja enviadas)
+function parseKeywords(raw){
+ const kws=new Set();
+ for(const k of raw.split(";")){
+  const kw=k.trim().toLowerCase();
+  if(kw) kws.add(kw);
+ }
+ return [...kws];
+}
+
+const customKeywords=parseKeywords(SEARCH_KEYWORDS || "");
+const KEYWORDS=customKeywords.length ? customKeywords : DEFAULT_KEYWORDS;
+
+// ================= OFERTAS =================
+
+// todas as fontes geram ofertas com as mesmas chaves na mesma ordem (inclusive
+// key/caption, preenchidas no envio): um unico "shape" no V8 para sort/filtro/envio
+function makeOffer({productName,imageUrl="",offerLink,priceMin,priceMax,discount=0,source}){
+ return{productName,imageUrl,offerLink,priceMin,priceMax,discount,source,key:"",caption:undefined};
+}
+
 // ================= SHOPEE =================
 
 const SHOPEE_URL="https://open-api.affiliate.shopee.com.br/graphql";
 
-async function fetchShopee(keyword){
+const SHOPEE_PAGES=[1,2];
 
- let results=[];
+const SHOPEE_CREDENTIAL=`SHA256 Credential=${SHOPEE_APP_ID}`;
 
- for(let page=1;page<=2;page++){
+const SHOPEE_NODE_FIELDS=`
+ nodes{
+  productName
+  imageUrl
+  offerLink
+  priceMin
+  priceMax
+ }
+`;
 
- const payload={
- query:"query productOfferV2($keyword:String,$limit:Int,$page:Int){productOfferV2(keyword:$keyword,limit:$limit,page:$page){nodes{productName imageUrl offerLink priceMin priceMax}}}",
- variables:{keyword,limit:20,page}
- };
+// todas as paginas num unico documento GraphQL (aliases p1, p2...): uma ida e volta.
+// escrito legivel e minificado uma vez no load: corpo menor e menos bytes para assinar
+const SHOPEE_QUERY=`query productOfferV2($keyword:String,$limit:Int){
+${SHOPEE_PAGES.map(page=>`p${page}:productOfferV2(keyword:$keyword,limit:$limit,page:${page}){${SHOPEE_NODE_FIELDS}}`).join("\n")}
+}`.replace(/\s+/g," ").replace(/ ?([{}]) ?/g,"$1");
 
- const payloadStr=JSON.stringify(payload);
- const timestamp=Math.floor(Date.now()/1000);
+// query ja escapada em JSON uma vez: cada corpo so serializa as variaveis
+const SHOPEE_BODY_PREFIX=`{"query":${JSON.stringify(SHOPEE_QUERY)},"variables":`;
 
- const sign=sha256Hex(`${SHOPEE_APP_ID}${timestamp}${payloadStr}${SHOPEE_APP_SECRET}`);
+// quando o Shopee recusa assinatura/timestamp por relogio dessincronizado,
+// tenta primeiro o desvio lido do header Date da propria resposta; os offsets
+// (s) fixos so sao testados se isso falhar. O que funcionar fica valendo para
+// o resto do processo
+const SHOPEE_CLOCK_PROBES=[-2,-1,1,2];
+let shopeeClockOffset=0;
+
+// orcamento de chamadas ao Shopee: so espera se estourar 5 req/s
+const shopeeQ=new DelayQueue(5,1000);
+
+// desvio (s) do relogio do servidor em relacao ao local; NaN sem header Date
+function serverSkew(resp){
+ return Math.round((Date.parse(resp.headers?.date)-Date.now())/1000);
+}
+
+function isShopeeClockError(resp){
+
+ if(resp.status===401) return true;
+
+ const errors=resp.body.errors || [];
+
+ return errors.some(e=>/signature|timestamp/i.test(JSON.stringify(e)));
+}
+
+// estado do SHA-256 ja com o app id absorvido: cada assinatura copia e so
+// alimenta timestamp, payload e secret, sem montar a string concatenada
+const shopeeSignBase=crypto.createHash("sha256").update(`${SHOPEE_APP_ID}`);
+const SHOPEE_SECRET_BYTES=Buffer.from(`${SHOPEE_APP_SECRET}`);
+
+function signShopee(timestamp,payload){
+ return shopeeSignBase.copy()
+ .update(`${timestamp}`)
+ .update(payload)
+ .update(SHOPEE_SECRET_BYTES)
+ .digest("hex");
+}
+
+// envia exatamente os bytes assinados (sem o axios serializar/codificar de novo)
+async function postShopee(payload,offset){
+
+ await shopeeQ.acquire();
+
+ const timestamp=Math.floor(Date.now()/1000)+offset;
+
+ const sign=signShopee(timestamp,payload);
 
  const headers={
  "Content-Type":"application/json",
- Authorization:`SHA256 Credential=${SHOPEE_APP_ID}, Timestamp=${timestamp}, Signature=${sign}`
+ Authorization:`${SHOPEE_CREDENTIAL}, Timestamp=${timestamp}, Signature=${sign}`
  };
 
- const resp=await axios.post(SHOPEE_URL,payload,{headers});
+ // texto cru guardado para a previa de erro; JSON decodificado uma unica vez
+ const resp=await api.post(SHOPEE_URL,payload,{
+ headers,
+ responseType:"text",
+ validateStatus:s=>s<400||s===401
+ });
+
+ let body={};
+ try{
+ body=JSON.parse(resp.data) || {};
+ }catch{}
+
+ return{status:resp.status,body,raw:resp.data,skew:serverSkew(resp)};
+}
 
- const nodes=resp?.data?.data?.productOfferV2?.nodes || [];
+// corpo codificado em UTF-8 uma vez por keyword (a lista e fixa, entao o cache
+// e limitado): assinatura, sondagens de relogio, retries e ciclos seguintes
+// usam o mesmo Buffer
+const shopeePayloads=new Map();
 
- results.push(...nodes);
+function shopeePayload(keyword){
 
+ let payload=shopeePayloads.get(keyword);
+
+ if(!payload){
+ payload=Buffer.from(`${SHOPEE_BODY_PREFIX}${JSON.stringify({keyword,limit:20})}}`);
+ shopeePayloads.set(keyword,payload);
+ }
+
+ return payload;
+}
+
+async function fetchShopee(keyword){
+
+ const payload=shopeePayload(keyword);
+
+ let resp=await postShopee(payload,shopeeClockOffset);
+
+ if(isShopeeClockError(resp) && Number.isFinite(resp.skew) && resp.skew!==shopeeClockOffset){
+ const skew=resp.skew;
+ resp=await postShopee(payload,skew);
+ if(!isShopeeClockError(resp)) shopeeClockOffset=skew;
+ }
+
+ if(isShopeeClockError(resp)){
+ for(const probe of SHOPEE_CLOCK_PROBES){
+ resp=await postShopee(payload,probe);
+ if(!isShopeeClockError(resp)){
+ shopeeClockOffset=probe;
+ break;
+ }
+ }
  }
 
- return results;
+ // previa so em falha e so com debug: fatia o texto cru, sem re-serializar
+ if(DEBUG && (resp.status===401 || resp.body.errors)){
+ log.debug("Shopee resposta",resp.raw.slice(0,RESPONSE_PREVIEW_CHARS));
+ }
+
+ if(resp.status>=400) throw new Error(`Shopee HTTP ${resp.status}`);
+
+ const data=resp.body.data || {};
+
+ return SHOPEE_PAGES
+ .flatMap(page=>data[`p${page}`]?.nodes || [])
+ .map(n=>makeOffer({
+ productName:n.productName,
+ imageUrl:n.imageUrl,
+ offerLink:n.offerLink,
+ priceMin:n.priceMin,
+ priceMax:n.priceMax,
+ source:"shopee"
+ }));
 }
 
 // ================= MERCADO LIVRE =================
 
+const ML_SEARCH_URL="https://api.mercadolibre.com/sites/MLB/search";
+
+const ML_HEADERS={Authorization:`Bearer ${ML_ACCESS_TOKEN}`};
+
 async function fetchMercadoLivre(keyword){
 
- const url=`https://api.mercadolibre.com/sites/MLB/search?q=${encodeURIComponent(keyword)}&limit=20`;
+ const url=`${ML_SEARCH_URL}?q=${encodeURIComponent(keyword)}&limit=20`;
 
- const resp=await axios.get(url,{
- headers:{Authorization:`Bearer ${ML_ACCESS_TOKEN}`}
- });
+ const resp=await api.get(url,{headers:ML_HEADERS});
 
  return resp.data.results.map(p=>{
 
@@ -129,7 +442,7 @@ async function fetchMercadoLivre(keyword){
 
  const discount=Math.round((1-price/original)*100);
 
- return{
+ return makeOffer({
  productName:p.title,
  imageUrl:p.thumbnail,
  offerLink:p.permalink,
@@ -137,126 +450,269 @@ async function fetchMercadoLivre(keyword){
  priceMax:original,
  discount,
  source:"mercadolivre"
- };
+ });
 
  });
 
 }
 
-// ================= SHEIN =================
+// ================= SCRAPING =================
 
-async function fetchShein(keyword){
+const SCRAPE_LIMIT=10;
 
- const url=`https://www.shein.com/pdsearch/${encodeURIComponent(keyword)}/`;
+// responseType text: o axios nao tenta JSON.parse na pagina inteira
+async function fetchHtml(url){
+ return (await api.get(url,{responseType:"text"})).data;
+}
 
- const html=(await axios.get(url)).data;
+// as lojas raspadas so diferem na config (url, regex, mapeamento): um unico fluxo
+async function scrape(store,keyword){
 
- const matches=[...html.matchAll(/"goods_name":"(.*?)".*?"goods_img":"(.*?)".*?"salePrice":"(.*?)"/g)];
+ const html=await fetchHtml(store.searchUrl(keyword));
 
- return matches.slice(0,10).map(m=>({
+ return firstMatches(html,store.pattern,SCRAPE_LIMIT)
+ .map(m=>makeOffer({...store.toOffer(m),source:store.source}));
+}
 
+// para no `max`-esimo produto em vez de varrer o HTML inteiro
+function firstMatches(html,re,max){
+
+ const out=[];
+
+ for(const m of html.matchAll(re)){
+ out.push(m);
+ if(out.length>=max) break;
+ }
+
+ return out;
+}
+
+// ================= SHEIN =================
+
+const SHEIN=Object.freeze({
+ source:"shein",
+ searchUrl:keyword=>`https://www.shein.com/pdsearch/${encodeURIComponent(keyword)}/`,
+ pattern:/"goods_name":"(.*?)".*?"goods_img":"(.*?)".*?"salePrice":"(.*?)"/g,
+ toOffer:m=>({
  productName:m[1],
  imageUrl:`https:${m[2]}`,
  offerLink:`SEU_LINK_AFILIADO_SHEIN`,
  priceMin:m[3],
- priceMax:m[3],
- source:"shein"
-
- }));
+ priceMax:m[3]
+ })
+});
 
-}
+const fetchShein=keyword=>scrape(SHEIN,keyword);
 
 // ================= MAGALU =================
 
-async function fetchMagalu(keyword){
-
- const url=`https://www.magazineluiza.com.br/busca/${encodeURIComponent(keyword)}/`;
-
- const html=(await axios.get(url)).data;
+const MAGALU=Object.freeze({
+ source:"magalu",
+ searchUrl:keyword=>`https://www.magazineluiza.com.br/busca/${encodeURIComponent(keyword)}/`,
+ pattern:/data-title="(.*?)".*?data-image="(.*?)"/g,
+ toOffer:m=>({
+ productName:m[1],
+ imageUrl:m[2],
+ offerLink:`SEU_LINK_AFILIADO_MAGALU`,
+ priceMin:"--",
+ priceMax:"--"
+ })
+});
 
- const matches=[...html.matchAll(/data-title="(.*?)".*?data-image="(.*?)"/g)];
+const fetchMagalu=keyword=>scrape(MAGALU,keyword);
 
- return matches.slice(0,10).map(m=>({
+// ================= C&A =================
 
+const CEA=Object.freeze({
+ source:"cea",
+ searchUrl:keyword=>`https://www.cea.com.br/busca?q=${encodeURIComponent(keyword)}`,
+ pattern:/"name":"(.*?)".*?"image":"(.*?)"/g,
+ toOffer:m=>({
  productName:m[1],
  imageUrl:m[2],
- offerLink:`SEU_LINK_AFILIADO_MAGALU`,
+ offerLink:`SEU_LINK_AFILIADO_CEA`,
  priceMin:"--",
- priceMax:"--",
- source:"magalu"
+ priceMax:"--"
+ })
+});
 
- }));
+const fetchCEA=keyword=>scrape(CEA,keyword);
 
+// ================= TELEGRAM =================
+
+const HTML_ESCAPES={"&":"&amp;","<":"&lt;",">":"&gt;","\"":"&quot;"};
+
+// nomes com < & " quebravam a formatacao e o envio caia no fallback
+function escapeHtml(v){
+ return String(v).replace(/[&<>"]/g,c=>HTML_ESCAPES[c]);
 }
 
-// ================= C&A =================
+// formatador pt-BR criado uma vez; precos repetidos saem do cache
+const BRL=new Intl.NumberFormat("pt-BR",{style:"currency",currency:"BRL"});
+const PRICE_CACHE_MAX=4096;
+const priceCache=new Map();
+
+// um unico typeof decide o caminho (numero do ML, string numerica do Shopee,
+// texto livre dos scrapers)
+function priceToBRL(v){
+ switch(typeof v){
+ case "number":
+  return Number.isFinite(v) ? BRL.format(v) : String(v);
+ case "string":{
+  const n=Number(v);
+  return v.trim() && Number.isFinite(n) ? BRL.format(n) : v;
+ }
+ default:
+  return String(v);
+ }
+}
 
-async function fetchCEA(keyword){
+function formatPrice(v){
 
- const url=`https://www.cea.com.br/busca?q=${encodeURIComponent(keyword)}`;
+ let out=priceCache.get(v);
 
- const html=(await axios.get(url)).data;
+ if(out===undefined){
+ out=priceToBRL(v);
+ if(priceCache.size>=PRICE_CACHE_MAX) priceCache.clear();
+ priceCache.set(v,out);
+ }
 
- const matches=[...html.matchAll(/"name":"(.*?)".*?"image":"(.*?)"/g)];
+ return out;
+}
 
- return matches.slice(0,10).map(m=>({
+function formatMsg(o){
 
- productName:m[1],
- imageUrl:m[2],
- offerLink:`SEU_LINK_AFILIADO_CEA`,
- priceMin:"--",
- priceMax:"--",
- source:"cea"
+return `🔥 <b>OFERTA</b>
 
- }));
+<b>${escapeHtml(o.productName)}</b>
+
+💰 De: ${escapeHtml(formatPrice(o.priceMax))}
+🔥 Por: <b>${escapeHtml(formatPrice(o.priceMin))}</b>
+
+🛒 <a href="${escapeHtml(o.offerLink)}">Comprar aqui</a>
+`;
 
 }
 
-// ================= TELEGRAM =================
+// formata uma vez por oferta; o fallback do grupo reaproveita a mesma legenda
+function caption(o){
+ return o.caption??=formatMsg(o);
+}
 
-function formatMsg(o){
+// o Telegram nao conseguiu baixar a imagem pela URL (CDN lento/bloqueado)
+const IMAGE_URL_ERROR=/failed to get HTTP URL content|wrong file identifier|wrong type of the web page content/i;
 
-return `🔥 *OFERTA*
+// file_id das imagens que precisaram de upload: o reenvio vai pelo id,
+// sem baixar e subir os bytes de novo
+const PHOTO_ID_CACHE_MAX=1024;
+const photoIds=new Map();
 
-*${o.productName}*
+const photoRef=o=>photoIds.get(o.imageUrl) || o.imageUrl;
 
-💰 De: ${o.priceMax}
-🔥 Por: *${o.priceMin}*
+// baixa a imagem aqui e envia os bytes, em vez de cair para texto
+async function uploadPhoto(o,opts){
 
-🛒 [Comprar aqui](${o.offerLink})
-`;
+ const img=await api.get(o.imageUrl,{responseType:"arraybuffer"});
 
-}
+ const sent=await bot.sendPhoto(
+ TELEGRAM_CHAT_ID,
+ Buffer.from(img.data),
+ opts,
+ {filename:"oferta.jpg",contentType:img.headers["content-type"] || "image/jpeg"}
+ );
 
-async function sendOffer(o){
+ const id=sent?.photo?.at(-1)?.file_id;
 
- const key=sha256Hex(o.offerLink);
+ if(id){
+ if(photoIds.size>=PHOTO_ID_CACHE_MAX) photoIds.clear();
+ photoIds.set(o.imageUrl,id);
+ }
 
- if(sentDB[key]) return;
+ return sent;
+}
+
+async function sendOffer(o,silent=false){
 
- sentDB[key]=Date.now();
- await saveSent();
+ const msg=caption(o);
 
- const msg=formatMsg(o);
+ await throttle();
 
  if(o.imageUrl){
- await bot.sendPhoto(
+ const opts={caption:msg,parse_mode:"HTML",disable_notification:silent};
+ try{
+ await withRetryAfter(()=>bot.sendPhoto(
  TELEGRAM_CHAT_ID,
- o.imageUrl,
- {caption:msg,parse_mode:"Markdown"}
- );
+ photoRef(o),
+ opts
+ ));
+ }catch(e){
+ if(!IMAGE_URL_ERROR.test(e.message)) throw e;
+ await withRetryAfter(()=>uploadPhoto(o,opts));
+ }
  }else{
- await bot.sendMessage(
+ await withRetryAfter(()=>bot.sendMessage(
  TELEGRAM_CHAT_ID,
  msg,
- {parse_mode:"Markdown"}
- );
+ {parse_mode:"HTML",disable_notification:silent}
+ ));
+ }
+
+}
+
+// so a primeira mensagem do ciclo notifica; as demais chegam em silencio
+// (evita o fan-out de push do Telegram para cada oferta do lote)
+async function sendOffersOneByOne(offers,silent=false){
+
+ for(const o of offers){
+
+ try{
+ await sendOffer(o,silent);
+ silent=true;
+ }catch(e){
+ log.debug("falha envio",o.offerLink,e.message);
+ }
+
+ }
+
+}
+
+// ate 10 fotos num unico sendMediaGroup; se falhar, manda uma a uma
+async function sendGroup(group,silent=false){
+
+ if(group.length<2) return sendOffersOneByOne(group,silent);
+
+ const media=group.map(o=>({
+ type:"photo",
+ media:photoRef(o),
+ caption:caption(o),
+ parse_mode:"HTML"
+ }));
+
+ await throttle(group.length);
+
+ try{
+ await withRetryAfter(()=>bot.sendMediaGroup(
+ TELEGRAM_CHAT_ID,
+ media,
+ {disable_notification:silent}
+ ));
+ }catch(e){
+ log.debug("falha sendMediaGroup",e.message);
+ await sendOffersOneByOne(group,silent);
  }
 
 }
 
 // ================= CICLO =================
 
+const FETCHERS={
+ shopee:fetchShopee,
+ mercadolivre:fetchMercadoLivre,
+ shein:fetchShein,
+ magalu:fetchMagalu,
+ cea:fetchCEA
+};
+
 let platformIndex=0;
 
 const platforms=[
@@ -269,6 +725,8 @@ const platforms=[
 "cea"
 ];
 
+// false se a busca ou a gravacao do historico falhou (so registrado no
+// processo residente; no RUN_ONCE vira codigo de saida 1)
 async function cycle(){
 
  cleanupDB();
@@ -281,56 +739,106 @@ async function cycle(){
  if(platformIndex>=platforms.length) platformIndex=0;
 
  let offers=[];
+ let ok=true;
 
  try{
+ offers=await FETCHERS[platform](keyword);
+ }catch(e){
+ log.error("erro",platform,e.message);
+ ok=false;
+ }
 
- if(platform==="shopee")
- offers=await fetchShopee(keyword);
-
- if(platform==="mercadolivre")
- offers=await fetchMercadoLivre(keyword);
-
- if(platform==="shein")
- offers=await fetchShein(keyword);
+ log.debug(platform,keyword,offers.length,"ofertas");
 
- if(platform==="magalu")
- offers=await fetchMagalu(keyword);
+ offers.sort((a,b)=>(b.discount||0)-(a.discount||0));
 
- if(platform==="cea")
- offers=await fetchCEA(keyword);
+ // filtra os ja enviados antes de formatar qualquer mensagem
+ // e descarta links repetidos dentro da propria busca
+ const unsent=[];
+ const seen=new Set();
 
+ for(const o of offers){
+ if(unsent.length>=OFFERS_PER_PUSH) break;
+ // oferta sem link nao tem chave: descarta so ela, como no envio
+ try{
+ o.key=offerKey(o.offerLink);
  }catch(e){
- console.log("erro",platform);
+ log.debug("oferta sem link",o.productName,e.message);
+ continue;
+ }
+ if(seen.has(o.key) || sentDB.has(o.key)) continue;
+ seen.add(o.key);
+ unsent.push(o);
  }
 
- offers.sort((a,b)=>(b.discount||0)-(a.discount||0));
+ if(!unsent.length) return ok;
 
- for(const o of offers.slice(0,OFFERS_PER_PUSH)){
+ const now=Date.now();
+ for(const o of unsent) sentDB.set(o.key,now);
 
- try{
- await sendOffer(o);
- await delay(DELAY_BETWEEN_OFFERS_MS);
- }catch{}
+ // a gravacao em disco corre junto com os envios ao Telegram; o handler vai
+ // junto com a promise, senao uma falha de disco durante os envios vira
+ // unhandledRejection e derruba o processo
+ const saving=appendSent(unsent.map(o=>o.key),now)
+ .then(()=>true,e=>{ log.error("falha ao gravar historico",e.message); return false; });
+
+ const withImage=unsent.filter(o=>o.imageUrl);
 
+ for(let i=0;i<withImage.length;i+=MEDIA_GROUP_SIZE){
+ await sendGroup(withImage.slice(i,i+MEDIA_GROUP_SIZE),i>0);
  }
 
+ await sendOffersOneByOne(unsent.filter(o=>!o.imageUrl),withImage.length>0);
+
+ return await saving && ok;
+
 }
 
 // SERVER
 
+// carrega o historico; false se nao ha bot
+async function start(){
+
+ // sem token nao ha para onde enviar: nao busca nem marca ofertas como enviadas
+ if(!bot){
+ log.error("TELEGRAM_BOT_TOKEN ausente, envio desativado");
+ return false;
+ }
+
+ await loadSent();
+
+ return true;
+}
+
+// RUN_ONCE=1: um ciclo e sai, para rodar por cron/agendador externo sem
+// processo residente nem servidor HTTP entre os envios
+if(RUN_ONCE==="1"){
+
+ start()
+ .then(async ok=>{ if(!ok || !await cycle()) process.exitCode=1; })
+ .catch(e=>{ log.error("falha no ciclo",e.message); process.exitCode=1; })
+ .finally(()=>{ httpAgent.destroy(); httpsAgent.destroy(); });
+
+}else{
+
 app.get("/",(_,res)=>res.send("bot rodando"));
 
+// processo residente: um ciclo com erro so e registrado, o proximo roda normalmente
+const logCycleError=e=>log.error("falha no ciclo",e.message);
+
 app.listen(PORT,"0.0.0.0",async()=>{
 
- await loadSent();
+ if(!await start().catch(e=>{ log.error("falha ao carregar historico",e.message); return true; })) return;
 
- await cycle();
+ await cycle().catch(logCycleError);
 
  setInterval(
- cycle,
+ ()=>cycle().catch(logCycleError),
  PUSH_INTERVAL_MINUTES*60*1000
  );
 
- console.log("BOT ONLINE");
+ log.info("BOT ONLINE");
+
+});
 
-});
\ No newline at end of file
+}